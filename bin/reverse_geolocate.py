@@ -15,22 +15,39 @@ import requests
 import configparser
 import unicodedata
 # import textwrap
-import glob
 import os
 import sys
+import errno
 import re
+import json
+import threading
+import time
+import tempfile
 # Note XMPFiles does not work with sidecar files, need to read via XMPMeta
-from libxmp import XMPMeta, consts
-from shutil import copyfile, get_terminal_size
-from math import ceil, radians, sin, cos, atan2, sqrt
+from libxmp import XMPMeta, XMPError, consts
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from shutil import copyfile, copymode, get_terminal_size
+from urllib.request import pathname2url
+from math import ceil, floor, pi, radians, sin, asin, cos, atan2, sqrt
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import accumulate
+from bisect import bisect_right
 
 ##############################################################
 # FUNCTIONS
 ##############################################################
 
-# this is for looking up if string is non latin letters
-# this is used by isLatin and onlyLatinChars
-cache_latin_letters = {}
+# compiled regex, used in the functions and argument checks below
+# distance argument: <number>[ ]m|km
+distance_re = re.compile(r'^(\d+)\s?(m|km)$')
+# lat/long in XMP/EXIF GPS format: <Degree>,<Minute.Second><NSEW>
+dms_latlong_re = re.compile(r'^(\d+),(\d+\.\d+)([NESW]{1})$')
+# backup file with counter
+backup_file_re = re.compile(r'.*\.BK\.(\d+)\.xmp$')
+# basic email check for the OpenStreetMap email: <name>@<domain>.<tld>
+email_re = re.compile(r'^.+@.+\.[A-Za-z]+$')
 
 
 # ARGPARSE HELPERS
@@ -40,19 +57,17 @@ cache_latin_letters = {}
 # AND it works on nargs *
 class writable_dir_folder(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
+        # init new output array in the namespace on the first call, later calls add to it
+        # there is no default list set for those arguments, so it can be changed in place
+        if type(getattr(namespace, self.dest)) is not list:
+            setattr(namespace, self.dest, [])
+        out = getattr(namespace, self.dest)
         # we loop through list (this is because of nargs *)
         for prospective_dir in values:
             # if valid and writeable (dir or file)
             if os.access(prospective_dir, os.W_OK):
-                # init new output array
-                out = []
-                # if we have a previous list in the namespace extend current list
-                if type(getattr(namespace, self.dest)) is list:
-                    out.extend(getattr(namespace, self.dest))
                 # add the new dir to it
                 out.append(prospective_dir)
-                # and write that list back to the self.dest in the namespace
-                setattr(namespace, self.dest, out)
             else:
                 raise argparse.ArgumentTypeError("writable_dir_folder: {0} is not a writable dir".format(prospective_dir))
 
@@ -73,7 +88,7 @@ class readable_dir(argparse.Action):
 # check distance values are valid
 class distance_values(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        m = re.match(r'^(\d+)\s?(m|km)$', values)
+        m = distance_re.match(values)
         if m:
             # convert to int in meters
             values = int(m.group(1))
@@ -88,7 +103,7 @@ class distance_values(argparse.Action):
 
 # METHOD: reverseGeolocate
 # PARAMS: latitude, longitude, map search target (google or openstreetmap)
-# RETURN: dict with all data (see below)
+# RETURN: dict with all data (see below), True if the data is from the persistent cache
 # DESC  : wrapper to call to either the google or openstreetmap
 def reverseGeolocate(longitude, latitude, map_type):
     # clean up long/lat
@@ -97,17 +112,128 @@ def reverseGeolocate(longitude, latitude, map_type):
     # NOTE: lat is N/S, long is E/W
     # detect and convert
     lat_long = longLatReg(longitude=longitude, latitude=latitude)
+    # check the persistent cache from previous runs first
+    geolocation_cache_key = geolocationCacheKey(lat_long['longitude'], lat_long['latitude'], map_type)
+    geolocation = geolocationCacheGet(geolocation_cache_key)
+    if geolocation is not None:
+        return geolocation, True
     # which service to use
     if map_type == 'google':
-        return reverseGeolocateGoogle(lat_long['longitude'], lat_long['latitude'])
+        geolocation = reverseGeolocateGoogle(lat_long['longitude'], lat_long['latitude'])
     elif map_type == 'openstreetmap':
-        return reverseGeolocateOpenStreetMap(lat_long['longitude'], lat_long['latitude'])
+        geolocation = reverseGeolocateOpenStreetMap(lat_long['longitude'], lat_long['latitude'])
     else:
         return {
             'Country': '',
             'status': 'ERROR',
             'error': 'Map type not valid'
-        }
+        }, False
+    # only store successful lookups, must have at least the country set
+    if geolocation['status'] != 'ERROR' and not geolocation['error_message'] and geolocation['Country']:
+        geolocationCacheSet(geolocation_cache_key, geolocation)
+    return geolocation, False
+
+
+# METHOD: geolocationCacheKey
+# PARAMS: longitude, latitude in float format, map search target
+# RETURN: key for the persistent cache or None if long/lat are not valid
+# DESC  : long/lat are rounded to 5 decimals (about 1m)
+def geolocationCacheKey(longitude, latitude, map_type):
+    try:
+        return '{}#{}#{}'.format(map_type, round(float(longitude), 5), round(float(latitude), 5))
+    except ValueError:
+        return None
+
+
+# METHOD: dataCacheKey
+# PARAMS: longitude, latitude in DMS or float format
+# RETURN: key for the data_cache, (longitude, latitude) tuple
+# DESC  : long/lat are rounded to 5 decimals (about 1m) as for the persistent cache
+#         so coordinates that are only a few cm apart use the same location
+#         not valid long/lat are used as they are
+def dataCacheKey(longitude, latitude):
+    lat_long = longLatReg(longitude=longitude, latitude=latitude)
+    try:
+        return (round(float(lat_long['longitude']), 5), round(float(lat_long['latitude']), 5))
+    except ValueError:
+        return (longitude, latitude)
+
+
+# METHOD: geolocationCacheGet
+# PARAMS: cache key
+# RETURN: geolocation dict from the persistent cache or None if not found or too old
+# DESC  : if the cache cannot be read (locked by another run, etc) it is handled as not found
+def geolocationCacheGet(key):
+    if cache_db is None or key is None:
+        return None
+    with cache_db_lock:
+        try:
+            row = cache_db.execute(
+                'SELECT geolocation FROM geolocation_cache WHERE cache_key = ? AND created >= ?',
+                (key, int(time.time()) - cache_max_age)
+            ).fetchone()
+        except sqlite3.Error as e:
+            print("(!) Could not read the lookup cache: {}".format(e))
+            return None
+    if args.debug:
+        print("### PERSISTENT CACHE: {}: {}".format(key, 'NO' if row is None else 'YES'))
+    return json.loads(row[0]) if row is not None else None
+
+
+# METHOD: geolocationCacheSet
+# PARAMS: cache key, geolocation dict
+# RETURN: none
+# DESC  : writes the lookup result to the persistent cache
+#         if the cache cannot be written (locked by another run, disk full, etc) the result is not stored
+def geolocationCacheSet(key, geolocation):
+    if cache_db is None or key is None:
+        return
+    with cache_db_lock:
+        try:
+            cache_db.execute(
+                'INSERT OR REPLACE INTO geolocation_cache (cache_key, geolocation, created) VALUES (?, ?, ?)',
+                (key, json.dumps(geolocation), int(time.time()))
+            )
+            cache_db.commit()
+        except sqlite3.Error as e:
+            print("(!) Could not write the lookup cache: {}".format(e))
+            # do not keep the failed insert open for the next one
+            cache_db.rollback()
+
+
+# METHOD: reverseGeolocateBatch
+# PARAMS: list of (longitude, latitude) pairs, map search target, number of parallel lookups
+# RETURN: list with the reverseGeolocate dict, persistent cache flag for each pair, in the same order
+# DESC  : the map lookups are network bound, so they are run in parallel threads
+#         pairs that share a persistent cache key are only looked up once
+def reverseGeolocateBatch(lat_long_list, map_type, workers=8):
+    lookup_keys = []
+    for lat_long in lat_long_list:
+        lat_long_float = longLatReg(longitude=lat_long[0], latitude=lat_long[1])
+        lookup_keys.append(
+            geolocationCacheKey(lat_long_float['longitude'], lat_long_float['latitude'], map_type) or lat_long
+        )
+    lookups = dict(zip(lookup_keys, lat_long_list))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(lookups, executor.map(
+            lambda lat_long: reverseGeolocate(longitude=lat_long[0], latitude=lat_long[1], map_type=map_type),
+            lookups.values()
+        )))
+    return [results[lookup_key] for lookup_key in lookup_keys]
+
+
+# METHOD: rateLimit
+# PARAMS: map search target
+# RETURN: none
+# DESC  : waits until the minimum time between two requests to the map service has passed
+#         OpenStreetMap allows only one request per second, google has a much higher limit
+#         the lock is held while waiting, so parallel lookups are queued up too
+def rateLimit(map_type):
+    with rate_limit_lock:
+        wait = rate_limit_last.get(map_type, 0) + rate_limit_interval[map_type] - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        rate_limit_last[map_type] = time.monotonic()
 
 
 # METHOD: reverseGeolocateInit
@@ -127,9 +253,12 @@ def reverseGeolocateInit(longitude, latitude):
         'status': '',
         'error_message': ''
     }
-    # error if long/lat is not valid
-    latlong_re = re.compile(r'^\d+\.\d+$')
-    if not latlong_re.match(str(longitude)) or not latlong_re.match(str(latitude)):
+    # error if long/lat is not valid, south and west are negative
+    try:
+        lat_long_valid = -90 <= float(latitude) <= 90 and -180 <= float(longitude) <= 180
+    except (TypeError, ValueError):
+        lat_long_valid = False
+    if not lat_long_valid:
         geolocation['status'] = 'ERROR'
         geolocation['error_message'] = 'Latitude {} or Longitude {} are not valid'.format(latitude, longitude)
     return geolocation
@@ -140,7 +269,7 @@ def reverseGeolocateInit(longitude, latitude):
 # RETURN: OpenStreetMap reverse lookcation lookup
 #         dict with locaiton, city, state, country, country code
 #         if not fillable, entry is empty
-# SAMPLE: https://nominatim.openstreetmap.org/reverse.php?format=jsonv2&lat=<latitude>&lon=<longitude>&zoom=21&accept-languge=en-US,en&
+# SAMPLE: https://nominatim.openstreetmap.org/reverse.php?format=jsonv2&lat=<latitude>&lon=<longitude>&zoom=17&addressdetails=1&accept-languge=en-US,en&
 def reverseGeolocateOpenStreetMap(longitude, latitude):
     # init
     geolocation = reverseGeolocateInit(longitude, latitude)
@@ -150,6 +279,9 @@ def reverseGeolocateOpenStreetMap(longitude, latitude):
     query_format = 'jsonv2'
     # language to return (english)
     language = 'en-US,en'
+    # detail level, 17 is the street level, the lowest used in the type map (road)
+    # building level (18) is not needed
+    zoom = 17
     # build query
     base = 'https://nominatim.openstreetmap.org/reverse.php?'
     # parameters
@@ -157,18 +289,35 @@ def reverseGeolocateOpenStreetMap(longitude, latitude):
         'format': query_format,
         'lat': latitude,
         'lon': longitude,
+        'zoom': zoom,
+        'addressdetails': 1,
         'accept-language': language
     }
     # if we have an email, add it here
     if args.email:
         payload['email'] = args.email
     url = "{base}".format(base=base)
-    response = requests.get(url, params=payload)
+    rateLimit('openstreetmap')
+    try:
+        response = http_session.get(url, params=payload, timeout=http_timeout)
+    except requests.exceptions.RequestException as e:
+        geolocation['status'] = 'ERROR'
+        geolocation['error_message'] = str(e)
+        print("Error in request: {}".format(geolocation['error_message']))
+        return geolocation
+    # parse the json only once, an error page is not valid json
+    try:
+        response_json = response.json()
+    except ValueError:
+        geolocation['status'] = 'ERROR'
+        geolocation['error_message'] = 'Not a valid response: {} {}'.format(response.status_code, response.reason)
+        print("Error in request: {}".format(geolocation['error_message']))
+        return geolocation
     # debug output
     if args.debug:
         print("OpenStreetMap search for Lat: {}, Long: {}".format(latitude, longitude))
     if args.debug and args.verbose >= 1:
-        print("OpenStreetMap response: {} => JSON: {}".format(response, response.json()))
+        print("OpenStreetMap response: {} => JSON: {}".format(response, response_json))
     # type map
     # Country to Location and for each in order of priority
     type_map = {
@@ -179,18 +328,20 @@ def reverseGeolocateOpenStreetMap(longitude, latitude):
         'Location': ['county', 'town', 'suburb', 'hamlet', 'neighbourhood', 'road']
     }
     # if not error
-    if 'error' not in response.json():
+    if 'error' not in response_json:
         # get address block
-        addr = response.json()['address']
+        addr = response_json['address']
         # loop for locations
         for loc_index in type_map:
             for index in type_map[loc_index]:
-                if index in addr and not geolocation[loc_index]:
+                if addr.get(index):
                     geolocation[loc_index] = addr[index]
+                    # first set in priority order is used, empty ones fall through to the next
+                    break
     else:
         geolocation['status'] = 'ERROR'
-        geolocation['error_message'] = response.json()['error']
-        print("Error in request: {}".format(geolocation['error']))
+        geolocation['error_message'] = response_json['error']
+        print("Error in request: {}".format(geolocation['error_message']))
     # return
     return geolocation
 
@@ -204,7 +355,6 @@ def reverseGeolocateOpenStreetMap(longitude, latitude):
 def reverseGeolocateGoogle(longitude, latitude):  # noqa: C901
     # init
     geolocation = reverseGeolocateInit(longitude, latitude)
-    temp_geolocation = geolocation.copy()
     if geolocation['status'] == 'ERROR':
         return geolocation
     # sensor (why?)
@@ -226,12 +376,27 @@ def reverseGeolocateGoogle(longitude, latitude):  # noqa: C901
         payload['key'] = args.google_api_key
     # build the full url and send it to google
     url = "{protocol}{base}".format(protocol=protocol, base=base)
-    response = requests.get(url, params=payload)
+    rateLimit('google')
+    try:
+        response = http_session.get(url, params=payload, timeout=http_timeout)
+    except requests.exceptions.RequestException as e:
+        geolocation['status'] = 'ERROR'
+        geolocation['error_message'] = str(e)
+        print("Error in request: {}".format(geolocation['error_message']))
+        return geolocation
+    # parse the json only once, an error page is not valid json
+    try:
+        response_json = response.json()
+    except ValueError:
+        geolocation['status'] = 'ERROR'
+        geolocation['error_message'] = 'Not a valid response: {} {}'.format(response.status_code, response.reason)
+        print("Error in request: {}".format(geolocation['error_message']))
+        return geolocation
     # debug output
     if args.debug:
         print("Google search for Lat: {}, Long: {} with {}".format(longitude, latitude, response.url))
     if args.debug and args.verbose >= 1:
-        print("Google response: {} => JSON: {}".format(response, response.json()))
+        print("Google response: {} => JSON: {}".format(response, response_json))
     # type map
     # For automated return of correct data into set to return
     type_map = {
@@ -241,53 +406,52 @@ def reverseGeolocateGoogle(longitude, latitude):  # noqa: C901
         'City': ['locality', 'administrative_area_level_3'],
         'Location': ['sublocality_level_1', 'sublocality_level_2', 'route'],
     }
-    # print("Error: {}".format(response.json()['status']))
-    if response.json()['status'] == 'OK':
+    # only results of these types are used for the location data
+    result_types = {'premise', 'route', 'street_address', 'sublocality'}
+    # print("Error: {}".format(response_json['status']))
+    if response_json['status'] == 'OK':
+        # first non LATIN name found for each location, used if no LATIN one is found
+        fallback_geolocation = {}
         # first entry for type = premise
-        for entry in response.json()['results']:
-            for sub_entry in entry:
-                if sub_entry == 'types' and (
-                    'premise' in entry[sub_entry] or
-                    'route' in entry[sub_entry] or
-                    'street_address' in entry[sub_entry] or
-                    'sublocality' in entry[sub_entry]
-                ):
-                    # print("Entry {}: {}".format(sub_entry, entry[sub_entry]))
-                    # print("Address {}".format(entry['address_components']))
-                    # type
-                    # -> country,
-                    # -> administrative_area (1, 2),
-                    # -> locality,
-                    # -> sublocality (_level_1 or 2 first found, then route)
-                    # so we get the data in the correct order
-                    for loc_index in type_map:
-                        for index in type_map[loc_index]:
-                            # this is an array, so we need to loop through each
-                            for addr in entry['address_components']:
-                                # in types check that index is in there and the location is not yet set
-                                # also check that entry is in LATIN based
-                                # NOTE: fallback if all are non LATIN?
-                                if index in addr['types'] and not geolocation[loc_index]:
-                                    # for country code we need to use short name, else we use long name
-                                    if loc_index == 'CountryCode':
-                                        if onlyLatinChars(addr['short_name']):
-                                            geolocation[loc_index] = addr['short_name']
-                                        elif not temp_geolocation[loc_index]:
-                                            temp_geolocation[loc_index] = addr['short_name']
-                                    else:
-                                        if onlyLatinChars(addr['long_name']):
-                                            geolocation[loc_index] = addr['long_name']
-                                        elif not temp_geolocation[loc_index]:
-                                            temp_geolocation[loc_index] = addr['long_name']
-        # check that all in geoloaction are filled and if not fille from temp_geolocation dictionary
-        for loc_index in type_map:
-            if not geolocation[loc_index] and temp_geolocation[loc_index]:
-                geolocation[loc_index] = temp_geolocation[loc_index]
+        for entry in response_json['results']:
+            if not result_types.isdisjoint(entry.get('types', [])):
+                # print("Entry types: {}".format(entry['types']))
+                # print("Address {}".format(entry['address_components']))
+                # type
+                # -> country,
+                # -> administrative_area (1, 2),
+                # -> locality,
+                # -> sublocality (_level_1 or 2 first found, then route)
+                # so we get the data in the correct order
+                # group the address components by type once, the order inside a type is kept
+                addr_by_type = {}
+                for addr in entry['address_components']:
+                    for addr_type in addr['types']:
+                        addr_by_type.setdefault(addr_type, []).append(addr)
+                for loc_index in type_map:
+                    # for country code we need to use short name, else we use long name
+                    name_key = 'short_name' if loc_index == 'CountryCode' else 'long_name'
+                    for index in type_map[loc_index]:
+                        # all address entries with this type until the location is set
+                        # also check that entry is in LATIN based
+                        # NOTE: fallback if all are non LATIN?
+                        for addr in addr_by_type.get(index, []):
+                            if geolocation[loc_index]:
+                                break
+                            if onlyLatinChars(addr[name_key]):
+                                geolocation[loc_index] = addr[name_key]
+                            elif addr[name_key]:
+                                fallback_geolocation.setdefault(loc_index, addr[name_key])
+        # check that all in geoloaction are filled and if not fill from the fallback_geolocation dictionary
+        for loc_index in fallback_geolocation:
+            if not geolocation[loc_index]:
+                geolocation[loc_index] = fallback_geolocation[loc_index]
         # write OK status
-        geolocation['status'] = response.json()['status']
+        geolocation['status'] = response_json['status']
     else:
-        geolocation['error_message'] = response.json()['error_message']
-        geolocation['status'] = response.json()['status']
+        # not all error status have an error message (eg ZERO_RESULTS)
+        geolocation['error_message'] = response_json.get('error_message', '')
+        geolocation['status'] = response_json['status']
         print("Error in request: {} {}".format(geolocation['status'], geolocation['error_message']))
     # return
     return geolocation
@@ -320,6 +484,27 @@ def convertLongToDMS(lat_long):
     return convertLatLongToDMS(lat_long, is_longitude=True)
 
 
+# METHOD: convertDMStoFloat
+# PARAMS: latitude or longitude in (n,n.nNSEW format)
+# RETURN: float value, or the value as is if it is not in this format
+# DESC  : converts one XMP/EXIF formatted GPS Long/Lat coordinate
+#         from the <Degree>,<Minute.Second><NSEW> to the normal float
+def convertDMStoFloat(value):
+    # already converted float data, nothing to do
+    if not isinstance(value, str):
+        return value
+    # match if it is exif GPS format
+    m = dms_latlong_re.match(value)
+    if m is None:
+        return value
+    # convert from Degree, Min.Sec into float format
+    value = float(m.group(1)) + (float(m.group(2)) / 60)
+    # if S or W => inverse to negative
+    if m.group(3) == 'S' or m.group(3) == 'W':
+        value *= -1
+    return value
+
+
 # METHOD: longLatReg
 # PARAMS: latitude in (n,n.nNSEW format), longitude
 # RETURN: dict with converted lat/long
@@ -327,78 +512,148 @@ def convertLongToDMS(lat_long):
 #         from the <Degree>,<Minute.Second><NSEW> to the normal float
 #         number used in google/lr internal
 def longLatReg(longitude, latitude):
-    # regex
-    latlong_re = re.compile(r'^(\d+),(\d+\.\d+)([NESW]{1})$')
-    # dict for loop
-    lat_long = {
-        'longitude': longitude,
-        'latitude': latitude
+    return {
+        'longitude': convertDMStoFloat(longitude),
+        'latitude': convertDMStoFloat(latitude)
     }
-    for element in lat_long:
-        # match if it is exif GPS format
-        m = latlong_re.match(lat_long[element])
-        if m is not None:
-            # convert from Degree, Min.Sec into float format
-            lat_long[element] = float(m.group(1)) + (float(m.group(2)) / 60)
-            # if S or W => inverse to negative
-            if m.group(3) == 'S' or m.group(3) == 'W':
-                lat_long[element] *= -1
-    return lat_long
 
 
 # wrapper calls for DMS to Lat/Long: latitude
 def convertDMStoLat(lat_long):
-    return longLatReg('0,0.0N', lat_long)['latitude']
+    return convertDMStoFloat(lat_long)
 
 
-# # wrapper calls for DMS to Lat/Long: longitude
+# wrapper calls for DMS to Lat/Long: longitude
 def convertDMStoLong(lat_long):
-    return longLatReg(lat_long, '0,0.0N')['longitude']
+    return convertDMStoFloat(lat_long)
+
+
+# METHOD: getHaversine
+# PARAMS: from long/lat, to long/lat, all in radians
+# RETURN: haversine of the angle between the two coordinates
+# DESC  : main distance calculation, the distance in meters is
+#         earth radius * 2 * atan2(sqrt(haversine), sqrt(1 - haversine))
+def getHaversine(from_longitude, from_latitude, to_longitude, to_latitude):
+    return sin((from_latitude - to_latitude) / 2)**2 + cos(from_latitude) * cos(to_latitude) * sin((from_longitude - to_longitude) / 2)**2
+
+
+# METHOD: fuzzyIndexInit
+# PARAMS: fuzzy distance in meters
+# RETURN: empty fuzzy index dict
+# DESC  : the index has the cache keys in insert order, the long/lat in radians for each key
+#         and a grid of cells with the key positions in each cell
+#         the cell size is the fuzzy distance, so only the cells next to the query cell
+#         need to be checked
+def fuzzyIndexInit(distance):
+    return {
+        'keys': [],
+        'coordinates': [],
+        'cells': {},
+        # earth radius in meters as in fuzzyIndexDistances, plus a small margin for rounding
+        'cell_size': distance / 6378137.0 * 1.0001 if distance else None
+    }
 
 
-# METHOD: getDistance
-# PARAMS: from long/lat, to long_lat
-# RETURN: distance in meters
-# DESC  : calculates the difference between two coordinates
-def getDistance(from_longitude, from_latitude, to_longitude, to_latitude):
+# METHOD: fuzzyIndexAdd
+# PARAMS: fuzzy index dict, cache key, longitude, latitude
+# RETURN: none
+# DESC  : adds the cache key to the index. invalid long/lat are not added
+def fuzzyIndexAdd(fuzzy_index, cache_key, longitude, latitude):
+    lat_long = longLatReg(longitude=longitude, latitude=latitude)
+    try:
+        longitude = radians(float(lat_long['longitude']))
+        latitude = radians(float(lat_long['latitude']))
+    except ValueError:
+        return
+    fuzzy_index['cells'].setdefault(
+        (floor(latitude / fuzzy_index['cell_size']), floor(longitude / fuzzy_index['cell_size'])), []
+    ).append(len(fuzzy_index['keys']))
+    fuzzy_index['keys'].append(cache_key)
+    fuzzy_index['coordinates'].append((longitude, latitude))
+
+
+# METHOD: fuzzyIndexDistances
+# PARAMS: fuzzy index dict, longitude, latitude, distance in meters
+# RETURN: list of cache key, distance in meters pairs in insert order that are in distance
+# DESC  : a point in distance can never be further away in latitude than the distance itself
+#         and not further away in longitude than the distance at this latitude allows
+#         so only the keys in those cells need the distance calculation
+#         uses getHaversine with the already converted long/lat
+#         the distance in meters is only calculated for the keys that are in distance
+def fuzzyIndexDistances(fuzzy_index, longitude, latitude, distance):
     # earth radius in meters
     earth_radius = 6378137.0
-    # convert all from radians with pre convert DMS to long and to float
-    from_longitude = radians(float(convertDMStoLong(from_longitude)))
-    from_latitude = radians(float(convertDMStoLat(from_latitude)))
-    to_longitude = radians(float(convertDMStoLong(to_longitude)))
-    to_latitude = radians(float(convertDMStoLat(to_latitude)))
-    # distance from - to
-    distance_longitude = from_longitude - to_longitude
-    distance_latitude = from_latitude - to_latitude
-    # main distance calculation
-    distance = sin(distance_latitude / 2)**2 + cos(from_latitude) * cos(to_latitude) * sin(distance_longitude / 2)**2
-    distance = 2 * atan2(sqrt(distance), sqrt(1 - distance))
-    return earth_radius * distance
+    lat_long = longLatReg(longitude=longitude, latitude=latitude)
+    try:
+        from_longitude = radians(float(lat_long['longitude']))
+        from_latitude = radians(float(lat_long['latitude']))
+    except ValueError:
+        return []
+    cos_from_latitude = cos(from_latitude)
+    cell_size = fuzzy_index['cell_size']
+    # distance as angle, with a small margin for rounding
+    # no point is further away than half of the earth, so all are in distance above pi
+    distance_angle = min(distance / earth_radius * 1.0001, pi)
+    latitude_cells = range(floor((from_latitude - distance_angle) / cell_size), floor((from_latitude + distance_angle) / cell_size) + 1)
+    # longitude cell ranges in distance, None for all if the distance reaches over the pole
+    # or is a quarter of the earth or more, sin does not grow after pi / 2 and the range would be too small
+    longitude_cells = None
+    if distance_angle < pi / 2 and cos_from_latitude > sin(distance_angle):
+        longitude_angle = asin(sin(distance_angle) / cos_from_latitude) * 1.0001
+        longitude_ranges = [(from_longitude - longitude_angle, from_longitude + longitude_angle)]
+        # wrap around at -180/180
+        if longitude_ranges[0][0] < -pi:
+            longitude_ranges = [(-pi, longitude_ranges[0][1]), (longitude_ranges[0][0] + 2 * pi, pi)]
+        elif longitude_ranges[0][1] > pi:
+            longitude_ranges = [(longitude_ranges[0][0], pi), (-pi, longitude_ranges[0][1] - 2 * pi)]
+        longitude_cells = [range(floor(start / cell_size), floor(end / cell_size) + 1) for start, end in longitude_ranges]
+    # check only the cells in distance, or go through all set cells if there are less of them
+    if longitude_cells is not None and len(latitude_cells) * sum(map(len, longitude_cells)) <= len(fuzzy_index['cells']):
+        cells = [(latitude_cell, longitude_cell) for latitude_cell in latitude_cells for _longitude_cells in longitude_cells for longitude_cell in _longitude_cells]
+    else:
+        cells = [
+            cell for cell in fuzzy_index['cells']
+            if cell[0] in latitude_cells and (longitude_cells is None or any(cell[1] in _longitude_cells for _longitude_cells in longitude_cells))
+        ]
+    # the distance calculation value for the max distance, with the margin for rounding
+    max_distance = sin(distance_angle / 2)**2
+    distances = []
+    for key_pos in sorted({key_pos for cell in cells for key_pos in fuzzy_index['cells'].get(cell, [])}):
+        to_longitude, to_latitude = fuzzy_index['coordinates'][key_pos]
+        _distance = getHaversine(from_longitude, from_latitude, to_longitude, to_latitude)
+        if _distance <= max_distance:
+            distances.append((fuzzy_index['keys'][key_pos], earth_radius * 2 * atan2(sqrt(_distance), sqrt(1 - _distance))))
+    return distances
+
+
+# METHOD: overwriteFlags
+# PARAMS: field_controls: array from args, keys: XMP keys
+# RETURN: dict with key: (write if data is not set, write if data is set)
+# DESC  : the field control flags do not change during a run, so they are checked once for each key
+#         1) data is not set
+#         2) data is set or not and field_control: overwrite only set
+#         3) data for key is not set, but only for key matches field_control
+#         4) data for key is set or not, but only for key matches field_control and overwrite is set
+def overwriteFlags(field_controls, keys):
+    field_controls = set(field_controls or [])
+    overwrite = 'overwrite' in field_controls
+    # only the keys given, or all keys if none are given
+    field_keys = field_controls - {'overwrite'}
+    flags = {}
+    for key in keys:
+        key_match = not field_keys or key.lower() in field_keys
+        flags[key] = (key_match, key_match and overwrite)
+    return flags
 
 
 # METHOD: checkOverwrite
-# PARAMS: data: value field, key: XMP key, field_controls: array from args
+# PARAMS: data: value field, key: XMP key, overwrite_flags: dict from overwriteFlags
 # RETURN: true/false
 # DESC  : checks with field control flags if given data for key should be written
-#         1) data is not set
-#         2) data is set or not and field_control: overwrite only set
-#         3) data for key is not set, but only for key matches field_control
-#         4) data for key is set or not, but only for key matches field_control and overwrite is set
-def checkOverwrite(data, key, field_controls):
-    status = False
-    # init field controls for empty
-    if not field_controls:
-        field_controls = []
-    if not data and (len(field_controls) == 0 or ('overwrite' in field_controls and len(field_controls) == 1)):
-        status = True
-    elif not data and key.lower() in field_controls:
-        status = True
-    elif data and 'overwrite' in field_controls and len(field_controls) == 1:
-        status = True
-    elif data and key.lower() in field_controls and 'overwrite' in field_controls:
-        status = True
+def checkOverwrite(data, key, overwrite_flags):
+    status = overwrite_flags[key][1 if data else 0]
     if args.debug:
+        field_controls = args.field_controls or []
         print("Data set: {data_set}, Key: {key_lower}, Field Controls len: {field_count}, Overwrite: {overwrite_flag}, Key in Field Controls: {key_ok}, OVERWRITE: {do_overwrite}".format(
             data_set='YES' if data else 'NO',
             key_lower=key.lower(),
@@ -420,11 +675,12 @@ def shortenPath(path, length=30, file_only=False, path_only=False):
     # I assume the XMP file name has no CJK characters inside, so I strip out the path
     # The reason is that if there are CJK characters inside it will screw up the formatting
     if file_only:
-        path = os.path.split(path)[1]
+        path = os.path.basename(path)
     if path_only:
-        path = os.path.split(path)[0]
-    if stringLenCJK(path) > length:
-        path = "{} {}".format("..", path[stringLenCJK(path) - length:])
+        path = os.path.dirname(path)
+    path_len_cjk = stringLenCJK(path)
+    if path_len_cjk > length:
+        path = "{} {}".format("..", path[path_len_cjk - length:])
     return path
 
 
@@ -433,24 +689,16 @@ def shortenPath(path, length=30, file_only=False, path_only=False):
 # RETURN: shortened string
 # DESC  : shortens a string to width and attached placeholder
 def shortenString(string, width, placeholder='..'):
-    # get the length with double byte charactes
-    string_len_cjk = stringLenCJK(str(string))
-    # if double byte width is too big
-    if string_len_cjk > width:
-        # set current length and output string
-        cur_len = 0
-        out_string = ''
-        # loop through each character
-        for char in str(string):
-            # set the current length if we add the character
-            cur_len += 2 if unicodedata.east_asian_width(char) in "WF" else 1
-            # if the new length is smaller than the output length to shorten too add the char
-            if cur_len <= (width - len(placeholder)):
-                out_string += char
-        # return string with new width and placeholder
-        return "{}{}".format(out_string, placeholder)
-    else:
-        return str(string)
+    string = str(string)
+    # running width after each character, with double byte characters
+    cur_len = list(accumulate(map(charWidthCJK, string)))
+    # if double byte width fits, nothing to shorten
+    if not cur_len or cur_len[-1] <= width:
+        return string
+    # find the last character that still fits with the placeholder attached
+    out_len = bisect_right(cur_len, width - len(placeholder))
+    # return string with new width and placeholder
+    return "{}{}".format(string[:out_len], placeholder)
 
 
 # METHOD: stringLenCJK
@@ -461,7 +709,17 @@ def shortenString(string, width, placeholder='..'):
 #         characters
 def stringLenCJK(string):
     """ return string len including double count for double width characters """
-    return sum(1 + (unicodedata.east_asian_width(c) in "WF") for c in string)
+    return sum(map(charWidthCJK, string))
+
+
+# METHOD: charWidthCJK
+# PARAMS: character
+# RETURN: 2 for double width characters, else 1
+# DESC  : the same characters are checked over and over in the list output
+#         so the unicode lookup is cached per character
+@lru_cache(maxsize=65536)
+def charWidthCJK(char):
+    return 2 if unicodedata.east_asian_width(char) in "WF" else 1
 
 
 # FROM: https://stackoverflow.com/a/3308844/7811993
@@ -469,13 +727,10 @@ def stringLenCJK(string):
 # PARAMS: character
 # RETURN: flagged LATIN or not char
 # DESC  : checks via the unciode class if a character is LATIN char based
+#         characters without a unicode name are not LATIN
+@lru_cache(maxsize=8192)
 def isLatin(uchr):
-    try:
-        # if we found in the dictionary return
-        return cache_latin_letters[uchr]
-    except KeyError:
-        # find LATIN in uncide type returned and set in dictionary for this character
-        return cache_latin_letters.setdefault(uchr, 'LATIN' in unicodedata.name(uchr))
+    return 'LATIN' in unicodedata.name(uchr, '')
 
 
 # FROM: https://stackoverflow.com/a/3308844/7811993
@@ -483,22 +738,28 @@ def isLatin(uchr):
 # PARAMS: string
 # RETURN: True/False for if string is LATIN char based
 # DESC  : chekcs if a string is based on LATIN chars. No for any CJK, Cyrillic, Hebrew, etc
+#         the same names come back for many lookups, so the result is cached per string
+#         all ASCII letters are LATIN, so those strings do not need the per char check
+@lru_cache(maxsize=4096)
 def onlyLatinChars(unistr):
+    if unistr.isascii():
+        return True
     return all(isLatin(uchr) for uchr in unistr if uchr.isalpha())
 
 
 # METHOD: printHeader
-# PARAMS: header string, line counter, print header counter trigger
+# PARAMS: header format string with page_no and page_all, line counter, print header counter trigger
 # RETURN: line counter +1
 # DESC  : prints header line and header seperator line
+#         the header is only formatted with the page number if it is printed
 def printHeader(header, lines=0, header_line=0):
     global page_no
     if lines == header_line:
+        # print header
+        print(header.format(page_no=page_no, page_all=page_all))
         # add one to the pages shown and reset the lines to start new page
         page_no += 1
         lines = 0
-        # print header
-        print("{}".format(header))
     lines += 1
     return lines
 
@@ -515,12 +776,25 @@ def formatLen(string, length):
     return length - (stringLenCJK(string) - len(string))
 
 
+# METHOD: formatListLine
+# PARAMS: row: dict with the column strings, width: dict with the column widths
+# RETURN: formatted line for the list view
+# DESC  : builds one list view line in a single pass. For columns with double byte
+#         characters the width needs to be adjusted before with formatLen
+def formatListLine(row, width):
+    return (
+        f" {row['filename']:<{width['filename']}} | {row['latitude']:>{width['latitude']}} | {row['longitude']:>{width['longitude']}} | "
+        f"{row['code']:<{width['code']}} | {row['country']:<{width['country']}} | {row['state']:<{width['state']}} | "
+        f"{row['city']:<{width['city']}} | {row['location']:<{width['location']}} | {row['path']:<{width['path']}}"
+    )
+
+
 # METHOD: fileSortNumber
 # PARAMS: file name
 # RETURN: number found in the BK string or 0 for none
 # DESC  : gets the BK number for sorting in the file list
 def fileSortNumber(file):
-    m = re.match(r'.*\.BK\.(\d+)\.xmp$', file)
+    m = backup_file_re.match(file)
     return int(m.group(1)) if m is not None else 0
 
 
@@ -561,8 +835,10 @@ def outputListWidthAdjust():
         # change sizes for print based on terminal size
         # NOTE: in screen or term this data might NOT be correct
         # Current size needs the in between and left/right space data
+        # terminal width is read once, the resize loop below does not change it
+        terminal_columns = get_terminal_size().columns
         current_columns = sum(format_length.values()) + ((len(format_length) - 1) * 3) + 2
-        if current_columns < get_terminal_size().columns:
+        if current_columns < terminal_columns:
             resize = 1
             format_key_order = ['path', 'location', 'state', 'city', 'country', 'filename']
         else:
@@ -586,9 +862,9 @@ def outputListWidthAdjust():
                     format_length[format_key] = resize_width if resize_width > resize_width_min else format_length[format_key]
                     # calc new width for check if we can abort
                     current_columns = sum(format_length.values()) + ((len(format_length) - 1) * 3) + 2
-                    if (resize == 1 and current_columns >= get_terminal_size().columns) or (resize == -1 and current_columns < get_terminal_size().columns):
+                    if (resize == 1 and current_columns >= terminal_columns) or (resize == -1 and current_columns < terminal_columns):
                         # check that we are not OVER but one under
-                        width_up = get_terminal_size().columns - current_columns - 1
+                        width_up = terminal_columns - current_columns - 1
                         if (resize == 1 and width_up < 0) or (resize == -1 and width_up != 0):
                             if format_length['path'] + width_up >= resize_width_min:
                                 format_length['path'] += width_up
@@ -596,41 +872,180 @@ def outputListWidthAdjust():
                         break
                 if abort:
                     break
-            if sum(format_length.values()) + ((len(format_length) - 1) * 3) + 2 > get_terminal_size().columns:
+            if sum(format_length.values()) + ((len(format_length) - 1) * 3) + 2 > terminal_columns:
                 print("[!!!] Screen layout might be skewed. Increase Terminal width")
     return format_length
 
 
+# METHOD: findXmpFiles
+# PARAMS: folder, set of excluded folders and files (normalized paths)
+# RETURN: list of XMP sidecar files in the folder and all sub folders
+# DESC  : the files of a folder are sorted and come before the files of the sub folders
+#         backup (.BK.) and excluded files are skipped, excluded folders are not entered
+def findXmpFiles(folder, exclude_sources):
+    xmp_files = []
+    sub_folders = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                # normalized as the exclude list, scandir keeps a ./ prefix of the folder
+                entry_path = os.path.normpath(entry.path)
+                if entry.is_dir():
+                    # same as os.walk, symlinked folders are not followed
+                    if not entry.is_symlink() and entry_path not in exclude_sources:
+                        sub_folders.append(entry_path)
+                elif entry.name.endswith('.xmp') and '.BK.' not in entry.name and entry_path not in exclude_sources:
+                    xmp_files.append(entry_path)
+    except OSError:
+        # folders we cannot read are skipped
+        return xmp_files
+    xmp_files.sort()
+    for sub_folder in sorted(sub_folders):
+        xmp_files.extend(findXmpFiles(sub_folder, exclude_sources))
+    return xmp_files
+
+
 # METHOD: getBackupFileCounter
 # PARAMS: file name
 # RETURN: next counter to be used for backup
-# DESC  :
+# DESC  : the folder of the file is only scanned once for .BK. files, the highest
+#         counter per file name is kept in backup_counters and increased on each call
 def getBackupFileCounter(xmp_file):
-    # set to 1 for if we have no backups yet
-    bk_file_counter = 1
-    # get PATH from file and look for .BK. data in this folder matching, output is sorted per BK counter key
-    for bk_file in sorted(
-        glob.glob("{path}/{file}*.xmp".format(
-            path=os.path.split(xmp_file)[0],
-            file="{}.BK.".format(os.path.splitext(os.path.split(xmp_file)[1])[0])
-            )
-        ),
-        # custom sort key to get the backup files sorted correctly
-        key=lambda pos: fileSortNumber(pos),
-        reverse=True
-    ):
-        # BK.1, etc -> get the number
-        bk_pos = fileSortNumber(bk_file)
-        if bk_pos > 0:
-            if args.debug:
-                print("#### **** File: {}, Counter: {} -> {}".format(bk_file, bk_pos, bk_pos + 1))
-            # check if found + 1 is bigger than set, if yes, set to new bk counter
-            if bk_pos + 1 > bk_file_counter:
-                bk_file_counter = bk_pos + 1
-                break
+    path, file = os.path.split(xmp_file)
+    file_name = os.path.splitext(file)[0]
+    # first write in this folder, collect the max BK counter for each file name in there
+    if path not in backup_counters:
+        backup_counters[path] = {}
+        with os.scandir(path or '.') as bk_files:
+            for bk_file in bk_files:
+                # BK.1, etc -> get the number
+                bk_pos = fileSortNumber(bk_file.name)
+                if bk_pos > 0 and bk_file.is_file():
+                    bk_file_name = bk_file.name.split('.BK.')[0]
+                    if args.debug:
+                        print("#### **** File: {}, Counter: {} -> {}".format(bk_file.path, bk_pos, bk_pos + 1))
+                    # keep the highest found counter
+                    if bk_pos > backup_counters[path].get(bk_file_name, 0):
+                        backup_counters[path][bk_file_name] = bk_pos
+    # set to 1 for if we have no backups yet, else max found + 1
+    bk_file_counter = backup_counters[path].get(file_name, 0) + 1
+    backup_counters[path][file_name] = bk_file_counter
     # return the next correct number for backup
     return bk_file_counter
 
+
+# METHOD: readXmpFile
+# PARAMS: xmp file name, optional list of fields to read, default all xmp_fields
+# RETURN: none
+# DESC  : parses the XMP file into the xmp meta object and reads the fields into the data_set
+def readXmpFile(xmp_file, field_keys=None):
+    # open file & read all into buffer, XMP is always UTF-8, do not depend on the locale
+    with open(xmp_file, 'r', encoding='utf-8') as fptr:
+        strbuffer = fptr.read()
+    # read fields from the XMP file and store in hash
+    xmp.parse_from_str(strbuffer)
+    readXmpFields(field_keys if field_keys is not None else xmp_fields)
+
+
+# METHOD: writeXmpFile
+# PARAMS: xmp file name, backup file name or None for no backup
+# RETURN: none
+# DESC  : writes the xmp meta object to the XMP file, symlinks are resolved to the real file
+#         the new data goes to a temporary file that replaces the real file, so the backup
+#         can be a hard link to the old file and needs no copy
+#         owner, group, mode and extended attributes (ACLs) are set from the old file
+#         if the file has other hard links, or the temporary file cannot be set up,
+#         the backup is copied and the file is written in place, so all links get the new data
+def writeXmpFile(xmp_file, bk_file=None):
+    xmp_data = xmp.serialize_to_str(omit_packet_wrapper=True)
+    xmp_file_real = os.path.realpath(xmp_file)
+    xmp_file_stat = os.stat(xmp_file_real)
+    xmp_file_tmp = None
+    if xmp_file_stat.st_nlink == 1:
+        try:
+            # unique name next to the real file, does not touch other files or parallel runs
+            tmp_fd, xmp_file_tmp = tempfile.mkstemp(
+                dir=os.path.dirname(xmp_file_real), prefix=os.path.basename(xmp_file_real) + '.', suffix='.tmp'
+            )
+            with os.fdopen(tmp_fd, 'w', encoding='utf-8') as fptr:
+                fptr.write(xmp_data)
+            tmp_file_stat = os.stat(xmp_file_tmp)
+            if (tmp_file_stat.st_uid, tmp_file_stat.st_gid) != (xmp_file_stat.st_uid, xmp_file_stat.st_gid):
+                os.chown(xmp_file_tmp, xmp_file_stat.st_uid, xmp_file_stat.st_gid)
+            copymode(xmp_file_real, xmp_file_tmp)
+            copyXattr(xmp_file_real, xmp_file_tmp)
+        except OSError:
+            # no write access to the folder, owner cannot be set, etc
+            if xmp_file_tmp is not None:
+                removeFile(xmp_file_tmp)
+            xmp_file_tmp = None
+    if bk_file is not None:
+        # a hard link only keeps the old data if the file is replaced and not written in place
+        backup_linked = False
+        if xmp_file_tmp is not None:
+            try:
+                os.link(xmp_file_real, bk_file)
+                backup_linked = True
+            except OSError:
+                # file system without hard links
+                pass
+        if not backup_linked:
+            copyfile(xmp_file_real, bk_file)
+    if xmp_file_tmp is not None:
+        try:
+            os.replace(xmp_file_tmp, xmp_file_real)
+        except OSError:
+            removeFile(xmp_file_tmp)
+            raise
+    else:
+        with open(xmp_file_real, 'w', encoding='utf-8') as fptr:
+            fptr.write(xmp_data)
+
+
+# METHOD: copyXattr
+# PARAMS: source file, target file
+# RETURN: none
+# DESC  : copies all extended attributes, this includes ACLs, from source to target file
+#         nothing is done if the system or file system has no extended attributes
+def copyXattr(source_file, target_file):
+    if not hasattr(os, 'listxattr'):
+        return
+    try:
+        xattr_names = os.listxattr(source_file)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.EOPNOTSUPP):
+            return
+        raise
+    for xattr_name in xattr_names:
+        os.setxattr(target_file, xattr_name, os.getxattr(source_file, xattr_name))
+
+
+# METHOD: removeFile
+# PARAMS: file name
+# RETURN: none
+# DESC  : removes the file if it exists, errors are ignored
+def removeFile(file):
+    try:
+        os.unlink(file)
+    except OSError:
+        pass
+
+
+# METHOD: readXmpFields
+# PARAMS: list of fields to read
+# RETURN: none
+# DESC  : reads the fields from the already parsed xmp meta object into the data_set
+def readXmpFields(field_keys):
+    for xmp_field in field_keys:
+        # the exempi routine fails with an XMPError if the property does not exist
+        # this is cheaper than a does_property_exist call for every field
+        try:
+            data_set[xmp_field] = xmp.get_property(xmp_fields[xmp_field], xmp_field)
+        except XMPError:
+            data_set[xmp_field] = ''
+        if args.debug:
+            print("### => XMP: {}:{} => {}".format(xmp_fields[xmp_field], xmp_field, data_set[xmp_field]))
+
 ##############################################################
 # ARGUMENT PARSNING
 ##############################################################
@@ -878,7 +1293,7 @@ if args.email and not args.use_openstreetmap:
     error = True
 # if email and not basic valid email (@ .)
 if args.email:
-    if not re.match(r'^.+@.+\.[A-Za-z]{1,}$', args.email):
+    if not email_re.match(args.email):
         print("Not a valid email for OpenStreetMap: {}".format(args.email))
         error = True
 # on error exit here
@@ -923,6 +1338,26 @@ if args.config_write and (args.google_api_key or args.email):
 if args.debug:
     print("### OVERRIDE API: G: {}, O: {}".format(args.google_api_key, args.email))
 
+# persistent cache for map lookups, in the same folder as the config file
+# only needed if we do lookups
+cache_db = None
+cache_db_lock = threading.Lock()
+# lookups older than this (in seconds, 30 days) are done again, map data can change
+cache_max_age = 30 * 24 * 60 * 60
+if not args.read_only:
+    try:
+        if not os.path.exists(config_folder):
+            os.makedirs(config_folder)
+        # lookups can run in parallel threads, access is serialized via cache_db_lock
+        cache_db = sqlite3.connect(os.path.join(config_folder, 'reverse_geolocate_cache.db'), check_same_thread=False)
+        cache_db.execute('CREATE TABLE IF NOT EXISTS geolocation_cache (cache_key TEXT PRIMARY KEY, geolocation TEXT, created INTEGER)')
+        # remove the lookups that are too old to be used
+        cache_db.execute('DELETE FROM geolocation_cache WHERE created < ?', (int(time.time()) - cache_max_age, ))
+        cache_db.commit()
+    except (OSError, sqlite3.Error) as e:
+        print("(!) Could not open the lookup cache in {}: {}".format(config_folder, e))
+        cache_db = None
+
 # The XMP fields const lookup values
 # XML/XMP
 # READ:
@@ -955,10 +1390,56 @@ data_set = {
     'Country': '',
     'CountryCode': ''
 }
+# which fields can be written, based on the field control flags
+overwrite_flags = overwriteFlags(args.field_controls, data_set)
 # original set for compare (is constant unchanged)
 data_set_original = {}
 # cache set to avoid double lookups for identical Lat/Ling
 data_cache = {}
+# the data_cache keys in grid cells, for the fuzzy distance lookup
+data_cache_fuzzy_index = fuzzyIndexInit(args.fuzzy_distance)
+# with fuzzy distance the lookups from previous runs are in the cache too
+# so exact and fuzzy matches to them are both read from the data_cache
+# the preloaded keys not used yet, the first exact match is counted as from the persistent cache
+data_cache_preloaded = set()
+if args.fuzzy_distance and cache_db is not None:
+    try:
+        for geolocation_cache_key, geolocation in cache_db.execute(
+            'SELECT cache_key, geolocation FROM geolocation_cache WHERE cache_key LIKE ? AND created >= ?',
+            ('{}#%'.format(map_type), int(time.time()) - cache_max_age)
+        ):
+            _, longitude, latitude = geolocation_cache_key.split('#')
+            cache_key = (float(longitude), float(latitude))
+            data_cache[cache_key] = json.loads(geolocation)
+            data_cache_preloaded.add(cache_key)
+            fuzzyIndexAdd(data_cache_fuzzy_index, cache_key, *cache_key)
+    except (sqlite3.Error, ValueError) as e:
+        print("(!) Could not read the lookup cache: {}".format(e))
+    if args.debug:
+        print("### PERSISTENT CACHE: preloaded {} locations".format(len(data_cache)))
+# highest backup file counter per folder and file name, read once per folder
+backup_counters = {}
+# one http session for all map lookups, keeps the connections open between requests
+# and retries on rate limit or temporary server errors
+http_session = requests.Session()
+http_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504], raise_on_status=False)
+)
+http_session.mount('https://', http_adapter)
+http_session.mount('http://', http_adapter)
+# OpenStreetMap requires an identifying user agent
+http_session.headers['User-Agent'] = 'reverse_geolocate.py (https://github.com/gullevek/reverse_geolocate)'
+# seconds to wait for the map service to connect and answer
+http_timeout = 10
+# minimum seconds between two requests per map service, and time of the last request
+rate_limit_interval = {
+    'google': 1 / 50,
+    'openstreetmap': 1.0
+}
+rate_limit_last = {}
+rate_limit_lock = threading.Lock()
 # work files, all files + folders we need to work on
 work_files = []
 # all failed files
@@ -976,6 +1457,7 @@ count = {
     'map': 0,
     'cache': 0,
     'fuzzy_cache': 0,
+    'persistent_cache': 0,
     'lightroom': 0,
     'changed': 0,
     'failed': 0,
@@ -999,17 +1481,22 @@ if args.lightroom_folder:
     query += 'LEFT JOIN AgInternedIptcCountry ON AgHarvestedIptcMetadata.countryRef = AgInternedIptcCountry.id_local '
     query += 'LEFT JOIN AgInternedIptcIsoCountryCode ON AgHarvestedIptcMetadata.isoCountryCodeRef = AgInternedIptcIsoCountryCode.id_local '
     query += 'WHERE Adobe_images.rootFile = AgLibraryFile.id_local AND Adobe_images.id_local = AgHarvestedExifMetadata.image AND AgLibraryFile.folder = AgLibraryFolder.id_local AND AgLibraryFolder.rootFolder = AgLibraryRootFolder.id_local '
-    query += 'AND AgLibraryFile.baseName = ?'
-    # absolutePath + pathFromRoot = path of XMP file - XMP file
-    if args.lightroom_strict:
-        query += 'AND AgLibraryRootFolder.absolutePath || AgLibraryFolder.pathFromRoot = ?'
+    # the base file names are read in batches, the placeholders (?, ...) are set per batch
+    # for the strict check absolutePath + pathFromRoot = path of XMP file - XMP file
+    query += 'AND AgLibraryFile.baseName IN ({})'
 
     # connect to LR database for reading
-    # open the folder and look for the first lrcat file in there
-    for file in os.listdir(args.lightroom_folder):
-        if file.endswith('.lrcat'):
-            lightroom_database = os.path.join(args.lightroom_folder, file)
-            lrdb = sqlite3.connect(lightroom_database)
+    # open the folder and look for the first lrcat file in there (by name)
+    lrdb = None
+    with os.scandir(args.lightroom_folder) as entries:
+        lightroom_database = min((entry.name for entry in entries if entry.name.endswith('.lrcat') and entry.is_file()), default=None)
+    if lightroom_database:
+        lightroom_database = os.path.join(args.lightroom_folder, lightroom_database)
+        try:
+            # we only read, so open read only, the path needs to be quoted for the uri
+            lrdb = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(lightroom_database))), uri=True)
+        except sqlite3.Error as e:
+            print("(!) Could not open the Lightroom DB {}: {}".format(lightroom_database, e))
     if not lightroom_database or not lrdb:
         print("(!) We could not find a lrcat file in the given lightroom folder or DB connection failed: {}".format(args.lightroom_folder))
         # flag for end
@@ -1019,6 +1506,12 @@ if args.lightroom_folder:
         lrdb.row_factory = sqlite3.Row
         # set cursor
         cur = lrdb.cursor()
+        # never write, 64MB page cache and memory mapped reads for the large join
+        # temporary sort/index data for the join is kept in memory
+        cur.execute('PRAGMA query_only = 1')
+        cur.execute('PRAGMA cache_size = -65536')
+        cur.execute('PRAGMA mmap_size = 268435456')
+        cur.execute('PRAGMA temp_store = MEMORY')
         # flag that we have Lightroom DB
         use_lightroom = True
     if args.debug:
@@ -1031,104 +1524,144 @@ if error:
 # init the XML meta for handling
 xmp = XMPMeta()
 
+# excluded folders and files in normalized form (no trailing /, no ./ or //), for the lookups below
+exclude_sources = {os.path.normpath(exclude_source) for exclude_source in args.exclude_sources}
+# all files already in work_files, so each file is only added once
+work_files_found = set()
 # loop through the xmp_sources (folder or files) and read in the XMP data for LAT/LONG, other data
 for xmp_file_source in args.xmp_sources:
-    # if folder, open and loop
-    # NOTE: we do check for folders in there, if there are we recourse traverse them
-    # also check that folder is not in exclude list
-    if os.path.isdir(xmp_file_source) and xmp_file_source.rstrip('/') not in [x.rstrip('/') for x in args.exclude_sources]:
-        # open folder and look for any .xmp files and push them into holding array
-        # if there are folders, dive into them
-        # or glob glob all .xmp files + directory
-        for root, dirs, files in os.walk(xmp_file_source):
-            for file in sorted(files):
-                # 1) but has no .BK. inside
-                # 2) file is not in exclude list
-                # 3) full folder is not in exclude list
-                if file.endswith(".xmp") and ".BK." not in file \
-                    and "{}/{}".format(root, file) not in args.exclude_sources \
-                    and root.rstrip('/') not in [x.rstrip('/') for x in args.exclude_sources]:
-                    if "{}/{}".format(root, file) not in work_files:
-                        work_files.append("{}/{}".format(root, file))
-                        count['all'] += 1
+    # normalized the same way as the exclude list, all found paths below are in the same form
+    xmp_file_source = os.path.normpath(xmp_file_source)
+    # skip if folder or file is in the exclude list
+    if xmp_file_source in exclude_sources:
+        continue
+    # if folder, open and look for any .xmp files, this includes all sub folders
+    if os.path.isdir(xmp_file_source):
+        xmp_files = findXmpFiles(xmp_file_source, exclude_sources)
     else:
-        # not already added to list and not in the exclude list either
-        if xmp_file_source not in work_files and xmp_file_source not in args.exclude_sources:
-            work_files.append(xmp_file_source)
+        xmp_files = [xmp_file_source]
+    for xmp_file in xmp_files:
+        # not already added to list
+        if xmp_file not in work_files_found:
+            work_files_found.add(xmp_file)
+            work_files.append(xmp_file)
             count['all'] += 1
 if args.debug:
     print("### Work Files {}".format(work_files))
 
 # if we have read only we print list format style
 if args.read_only:
-    # adjust the output width for the list view
-    format_length = outputListWidthAdjust()
-
-    # after how many lines do we reprint the header
-    header_repeat = 50
-    # how many pages will we have
-    page_all = ceil(len(work_files) / header_repeat)
-    # current page number
-    page_no = 1
-    # the formatted line for the output
-    # 4 {} => final replace: data (2 pre replaces)
-    # 1 {} => length replace here
-    format_line = " {{{{filename:<{}}}}} | {{{{latitude:>{}}}}} | {{{{longitude:>{}}}}} | {{{{code:<{}}}}} | {{{{country:<{}}}}} | {{{{state:<{}}}}} | {{{{city:<{}}}}} | {{{{location:<{}}}}} | {{{{path:<{}}}}}".format(
-        "{filenamelen}",
-        format_length['latitude'],
-        format_length['longitude'],
-        format_length['code'],
-        "{countrylen}",
-        "{statelen}",
-        "{citylen}",
-        "{locationlen}",
-        "{pathlen}"  # set path len replacer variable
-    )
-    # header line format:
-    # blank line
-    # header title
-    # seperator line
-    header_line = '''{}
+    # only build the list layout if there is anything to list
+    if work_files:
+        # adjust the output width for the list view
+        format_length = outputListWidthAdjust()
+
+        # after how many lines do we reprint the header
+        header_repeat = 50
+        # how many pages will we have
+        page_all = ceil(len(work_files) / header_repeat)
+        # current page number
+        page_no = 1
+        # header line format:
+        # blank line
+        # header title
+        # seperator line
+        header_line = '''{}
 {}
 {}'''.format(
-        '> Page {page_no:,}/{page_all:,}',  # can later be set to something else, eg page numbers
-        # pre replace path length before we add the header titles
-        format_line.format(
-            filenamelen=format_length['filename'],
-            countrylen=format_length['country'],
-            statelen=format_length['state'],
-            citylen=format_length['city'],
-            locationlen=format_length['location'],
-            pathlen=format_length['path']
-        ).format(  # the header title line
-            filename='File'[:format_length['filename']],
-            latitude='Latitude'[:format_length['latitude']],
-            longitude='Longitude'[:format_length['longitude']],
-            code='Code',
-            country='Country'[:format_length['country']],
-            state='State'[:format_length['state']],
-            city='City'[:format_length['city']],
-            location='Location'[:format_length['location']],
-            path='Path'[:format_length['path']]
-        ),
-        "{}+{}+{}+{}+{}+{}+{}+{}+{}".format(  # the header seperator line
-            '-' * (format_length['filename'] + 2),
-            '-' * (format_length['latitude'] + 2),
-            '-' * (format_length['longitude'] + 2),
-            '-' * (format_length['code'] + 2),
-            '-' * (format_length['country'] + 2),
-            '-' * (format_length['state'] + 2),
-            '-' * (format_length['city'] + 2),
-            '-' * (format_length['location'] + 2),
-            '-' * (format_length['path'] + 2)
+            '> Page {page_no:,}/{page_all:,}',  # can later be set to something else, eg page numbers
+            formatListLine({  # the header title line
+                'filename': 'File'[:format_length['filename']],
+                'latitude': 'Latitude'[:format_length['latitude']],
+                'longitude': 'Longitude'[:format_length['longitude']],
+                'code': 'Code',
+                'country': 'Country'[:format_length['country']],
+                'state': 'State'[:format_length['state']],
+                'city': 'City'[:format_length['city']],
+                'location': 'Location'[:format_length['location']],
+                'path': 'Path'[:format_length['path']]
+            }, format_length),
+            "{}+{}+{}+{}+{}+{}+{}+{}+{}".format(  # the header seperator line
+                '-' * (format_length['filename'] + 2),
+                '-' * (format_length['latitude'] + 2),
+                '-' * (format_length['longitude'] + 2),
+                '-' * (format_length['code'] + 2),
+                '-' * (format_length['country'] + 2),
+                '-' * (format_length['state'] + 2),
+                '-' * (format_length['city'] + 2),
+                '-' * (format_length['location'] + 2),
+                '-' * (format_length['path'] + 2)
+            )
         )
-    )
-    # print header
-    printHeader(header_line.format(page_no=page_no, page_all=page_all))
-    # print no files found if we have no files
-    if not work_files:
+        # print header
+        printHeader(header_line)
+    else:
+        # print no files found if we have no files
         print("{:<60}".format('[!!!] No files found'))
 
+# ### LIGHTROOM DB READING
+# read the Lightroom data for all files in batches instead of one query per file
+# key is the base file name, for the strict check the base file name and the folder path
+lightroom_rows = {}
+if use_lightroom and not args.read_only:
+    lightroom_basenames = list({os.path.splitext(os.path.basename(xmp_file))[0] for xmp_file in work_files})
+    # stay below the SQLite limit for parameters in one query
+    lightroom_batch_size = 500
+    for lightroom_batch_pos in range(0, len(lightroom_basenames), lightroom_batch_size):
+        lightroom_batch = lightroom_basenames[lightroom_batch_pos:lightroom_batch_pos + lightroom_batch_size]
+        cur.execute(query.format(', '.join(['?'] * len(lightroom_batch))), lightroom_batch)
+        for lrdb_row in cur:
+            if args.lightroom_strict:
+                lightroom_key = (lrdb_row['baseName'], '{}{}'.format(lrdb_row['absolutePath'], lrdb_row['pathFromRoot']))
+            else:
+                lightroom_key = lrdb_row['baseName']
+            lightroom_rows.setdefault(lightroom_key, []).append(lrdb_row)
+
+# ### MAP LOOKUP PREFETCH
+# collect all coordinates that will need a map lookup and run those lookups in parallel
+# the main loop then takes the location from the prefetch_cache instead of calling the map service
+# Only for google, OpenStreetMap allows only one request per second. And not with Lightroom,
+# as the Lightroom data can fill the missing fields and then no lookup is needed for that file
+prefetch_cache = {}
+# files the prefetch found with no field to set, the main loop skips them without reading them again
+prefetch_no_write = set()
+if not args.read_only and map_type == 'google' and not use_lightroom:
+    # all cache keys the main loop will have in the data_cache
+    prefetch_keys = set()
+    prefetch_fuzzy_index = fuzzyIndexInit(args.fuzzy_distance)
+    prefetch_lat_long = []
+    for xmp_file in work_files:
+        readXmpFile(xmp_file)
+        # same as the main loop: only if there is a field to set, and we need the GPS data for the lookup
+        if not any(checkOverwrite(data_set[loc], loc, overwrite_flags) for loc in data_set_loc):
+            prefetch_no_write.add(xmp_file)
+            continue
+        if not data_set['GPSLatitude'] or not data_set['GPSLongitude']:
+            continue
+        cache_key = dataCacheKey(data_set['GPSLongitude'], data_set['GPSLatitude'])
+        if cache_key in prefetch_keys or cache_key in data_cache:
+            continue
+        # if there is a collected or cached location in fuzzy distance, the main loop will use that one from the cache
+        if not args.fuzzy_distance or not any(
+            distance <= args.fuzzy_distance
+            for fuzzy_index in (data_cache_fuzzy_index, prefetch_fuzzy_index)
+            for _, distance in fuzzyIndexDistances(
+                fuzzy_index, data_set['GPSLongitude'], data_set['GPSLatitude'], args.fuzzy_distance
+            )
+        ):
+            prefetch_lat_long.append((data_set['GPSLongitude'], data_set['GPSLatitude']))
+        prefetch_keys.add(cache_key)
+        if args.fuzzy_distance:
+            fuzzyIndexAdd(prefetch_fuzzy_index, cache_key, data_set['GPSLongitude'], data_set['GPSLatitude'])
+    if prefetch_lat_long:
+        print("Prefetch map locations for {} coordinates".format(len(prefetch_lat_long)))
+        prefetch_cache = dict(zip(
+            [dataCacheKey(longitude, latitude) for longitude, latitude in prefetch_lat_long],
+            reverseGeolocateBatch(prefetch_lat_long, map_type)
+        ))
+    if args.debug:
+        print("### Prefetch: {}".format(prefetch_cache))
+
 # ### MAIN WORK LOOP
 # now we just loop through each file and work on them
 for xmp_file in work_files:  # noqa: C901
@@ -1138,67 +1671,65 @@ for xmp_file in work_files:  # noqa: C901
     # ### ACTION FLAGs
     write_file = False
 
+    # nothing to set in this file, already found in the prefetch
+    if xmp_file in prefetch_no_write:
+        print("[SKIP]")
+        count['skipped'] += 1
+        continue
+
     # ### XMP FILE READING
-    # open file & read all into buffer
-    with open(xmp_file, 'r') as fptr:
-        strbuffer = fptr.read()
-    # read fields from the XMP file and store in hash
-    xmp.parse_from_str(strbuffer)
-    for xmp_field in xmp_fields:
-        # need to check if propert exist or it will the exempi routine will fail
-        if xmp.does_property_exist(xmp_fields[xmp_field], xmp_field):
-            data_set[xmp_field] = xmp.get_property(xmp_fields[xmp_field], xmp_field)
-        else:
-            data_set[xmp_field] = ''
-        if args.debug:
-            print("### => XMP: {}:{} => {}".format(xmp_fields[xmp_field], xmp_field, data_set[xmp_field]))
+    # for the unset GPS only list, the GPS fields decide if the file is listed
+    # the other fields are only read if it is
+    if args.read_only and args.unset_gps_only and not args.unset_only:
+        readXmpFile(xmp_file, ('GPSLatitude', 'GPSLongitude'))
+        if data_set['GPSLatitude'] and data_set['GPSLongitude']:
+            continue
+        readXmpFields(data_set_loc)
+    else:
+        readXmpFile(xmp_file)
     if args.read_only:
         # view only if list all or if data is unset
         if (not args.unset_only and not args.unset_gps_only) or (args.unset_only and '' in data_set.values()) or (args.unset_gps_only and (not data_set['GPSLatitude'] or not data_set['GPSLongitude'])):
             # for read only we print out the data formatted
             # headline check, do we need to print that
-            count['read'] = printHeader(header_line.format(page_no=page_no, page_all=page_all), count['read'], header_repeat)
-            # the data content
-            print(format_line.format(
-                    # for all possible non latin fields we do adjust if it has double byte characters inside
-                    filenamelen=formatLen(shortenPath(xmp_file, format_length['filename'], file_only=True), format_length['filename']),
-                    countrylen=formatLen(shortenString(data_set['Country'], width=format_length['country']), format_length['country']),
-                    statelen=formatLen(shortenString(data_set['State'], width=format_length['state']), format_length['state']),
-                    citylen=formatLen(shortenString(data_set['City'], width=format_length['city']), format_length['city']),
-                    locationlen=formatLen(shortenString(data_set['Location'], width=format_length['location']), format_length['location']),
-                    pathlen=formatLen(shortenPath(xmp_file, format_length['path'], path_only=True), format_length['path'])
-                ).format(
-                    filename=shortenPath(xmp_file, format_length['filename'], file_only=True),  # shorten from the left
-                    latitude=str(convertDMStoLat(data_set['GPSLatitude']))[:format_length['latitude']],  # cut off from the right
-                    longitude=str(convertDMStoLong(data_set['GPSLongitude']))[:format_length['longitude']],
-                    code=data_set['CountryCode'][:2].center(4),  # is only 2 chars
-                    country=shortenString(data_set['Country'], width=format_length['country']),  # shorten from the right
-                    state=shortenString(data_set['State'], width=format_length['state']),
-                    city=shortenString(data_set['City'], width=format_length['city']),
-                    location=shortenString(data_set['Location'], width=format_length['location']),
-                    path=shortenPath(xmp_file, format_length['path'], path_only=True)
-                )
-            )
+            count['read'] = printHeader(header_line, count['read'], header_repeat)
+            # the data content, each column value is only shortened once
+            list_row = {
+                'filename': shortenPath(xmp_file, format_length['filename'], file_only=True),  # shorten from the left
+                'latitude': str(convertDMStoLat(data_set['GPSLatitude']))[:format_length['latitude']],  # cut off from the right
+                'longitude': str(convertDMStoLong(data_set['GPSLongitude']))[:format_length['longitude']],
+                'code': data_set['CountryCode'][:2].center(4),  # is only 2 chars
+                'country': shortenString(data_set['Country'], width=format_length['country']),  # shorten from the right
+                'state': shortenString(data_set['State'], width=format_length['state']),
+                'city': shortenString(data_set['City'], width=format_length['city']),
+                'location': shortenString(data_set['Location'], width=format_length['location']),
+                'path': shortenPath(xmp_file, format_length['path'], path_only=True)
+            }
+            # for all possible non latin fields we do adjust if it has double byte characters inside
+            print(formatListLine(list_row, {
+                list_key: formatLen(list_row[list_key], format_length[list_key]) for list_key in format_length
+            }))
             count['listed'] += 1
     else:
         # ### LR Action Flag (data ok)
         lightroom_data_ok = True
-        # ### LIGHTROOM DB READING
-        # read in data from DB if we uave lightroom folder
+        # file name without and with extension, split once for the Lightroom lookup and the backup file
+        xmp_file_root, xmp_file_ext = os.path.splitext(xmp_file)
+        # ### LIGHTROOM DB DATA
+        # get the data read from DB if we uave lightroom folder
         if use_lightroom:
             # get the base file name, we need this for lightroom
-            xmp_file_basename = os.path.splitext(os.path.split(xmp_file)[1])[0]
-            # try to get this file name from the DB
-            lr_query_params = [xmp_file_basename]
+            xmp_file_basename = os.path.basename(xmp_file_root)
             # for strict check we need to get the full path, and add / as the LR stores the last folder with /
             if args.lightroom_strict:
-                xmp_file_path = "{}/{}".format(os.path.split(xmp_file)[0], '/')
-                lr_query_params.append(xmp_file_path)
-            cur.execute(query, lr_query_params)
+                lightroom_key = (xmp_file_basename, "{}/".format(os.path.dirname(os.path.abspath(xmp_file))))
+            else:
+                lightroom_key = xmp_file_basename
+            lrdb_rows = lightroom_rows.get(lightroom_key, [])
             # get the row data
-            lrdb_row = cur.fetchone()
+            lrdb_row = lrdb_rows[0] if lrdb_rows else None
             # abort the read because we found more than one row
-            if cur.fetchone() is not None:
+            if len(lrdb_rows) > 1:
                 print("(!) Lightroom DB returned more than one more row")
                 lightroom_data_ok = False
                 count['many_found'] += 1
@@ -1217,7 +1748,8 @@ for xmp_file in work_files:  # noqa: C901
         # same for location names
         # if missing in XMP but in LR -> set in XMP
         # if missing in both do lookup in Maps
-        if use_lightroom and lightroom_data_ok:
+        # LR data only fills missing data, nothing to do if all is set in the XMP
+        if use_lightroom and lightroom_data_ok and not all(data_set.values()):
             # check lat/long separate
             if lrdb_row['gpsLatitude'] and not data_set['GPSLatitude']:
                 # we need to convert to the Degree,Min.sec[NSEW] format
@@ -1233,15 +1765,12 @@ for xmp_file in work_files:  # noqa: C901
                         print("### -> LR: {} => {}".format(loc, lrdb_row[loc]))
         # base set done, now check if there is anything unset in the data_set, if yes do a lookup in maps
         # run this through the overwrite checker to get unset if we have a forced overwrite
-        has_unset = False
         failed = False
         from_cache = False
-        for loc in data_set_loc:
-            if checkOverwrite(data_set[loc], loc, args.field_controls):
-                has_unset = True
+        has_unset = any(checkOverwrite(data_set[loc], loc, overwrite_flags) for loc in data_set_loc)
         if has_unset:
             # check if lat/long is in cache
-            cache_key = '{}#{}'.format(data_set['GPSLongitude'], data_set['GPSLatitude'])
+            cache_key = dataCacheKey(data_set['GPSLongitude'], data_set['GPSLatitude'])
             if args.debug:
                 print("### *** CACHE: {}: {}".format(cache_key, 'NO' if cache_key not in data_cache else 'YES'))
             # main chache check = identical
@@ -1254,12 +1783,8 @@ for xmp_file in work_files:  # noqa: C901
                     shortest_distance = args.fuzzy_distance
                     best_match_latlong = ''
                     # check if we have fuzzy distance, if no valid found do maps lookup
-                    for _cache_key in data_cache:
-                        # split up cache key so we can use in the distance calc method
-                        to_lat_long = _cache_key.split('#')
-                        # get the distance based on current set + cached set
-                        # print("Lookup f-long {} f-lat {} t-long {} t-lat {}".format(data_set['GPSLongitude'], data_set['GPSLatitude'], to_lat_long[0], to_lat_long[1]))
-                        distance = getDistance(from_longitude=data_set['GPSLongitude'], from_latitude=data_set['GPSLatitude'], to_longitude=to_lat_long[0], to_latitude=to_lat_long[1])
+                    # get the distance based on current set + cached sets that can be in distance
+                    for _cache_key, distance in fuzzyIndexDistances(data_cache_fuzzy_index, data_set['GPSLongitude'], data_set['GPSLatitude'], args.fuzzy_distance):
                         if args.debug:
                             print("### **= FUZZY CACHE: => distance: {} (m), shortest: {}".format(distance, shortest_distance))
                         if distance <= shortest_distance:
@@ -1270,16 +1795,25 @@ for xmp_file in work_files:  # noqa: C901
                             if args.debug:
                                 print("### ***= FUZZY CACHE: YES => Best match: {}".format(best_match_latlong))
                 if not has_fuzzy_cache:
-                    # get location from maps (google or openstreetmap)
-                    maps_location = reverseGeolocate(latitude=data_set['GPSLatitude'], longitude=data_set['GPSLongitude'], map_type=map_type)
+                    # get location from maps (google or openstreetmap), if not already done in the prefetch
+                    if cache_key in prefetch_cache:
+                        maps_location, from_cache = prefetch_cache.pop(cache_key)
+                    else:
+                        maps_location, from_cache = reverseGeolocate(latitude=data_set['GPSLatitude'], longitude=data_set['GPSLongitude'], map_type=map_type)
                     # cache data with Lat/Long
                     data_cache[cache_key] = maps_location
-                    from_cache = False
+                    if args.fuzzy_distance:
+                        fuzzyIndexAdd(data_cache_fuzzy_index, cache_key, data_set['GPSLongitude'], data_set['GPSLatitude'])
+                    # found in the persistent cache from a previous run, no map lookup was done
+                    if from_cache:
+                        count['cache'] += 1
+                        count['persistent_cache'] += 1
                 else:
                     maps_location = data_cache[best_match_latlong]
                     # cache this one, because the next one will match this one too
                     # we don't need to loop search again for the same fuzzy location
                     data_cache[cache_key] = maps_location
+                    fuzzyIndexAdd(data_cache_fuzzy_index, cache_key, data_set['GPSLongitude'], data_set['GPSLatitude'])
                     count['cache'] += 1
                     count['fuzzy_cache'] += 1
                     from_cache = True
@@ -1287,6 +1821,10 @@ for xmp_file in work_files:  # noqa: C901
                 # load location from cache
                 maps_location = data_cache[cache_key]
                 count['cache'] += 1
+                # same count as without fuzzy distance, where the first one is read from the persistent cache
+                if cache_key in data_cache_preloaded:
+                    data_cache_preloaded.discard(cache_key)
+                    count['persistent_cache'] += 1
                 from_cache = True
             # overwrite sets (note options check here)
             if args.debug:
@@ -1295,11 +1833,11 @@ for xmp_file in work_files:  # noqa: C901
             if maps_location['Country']:
                 for loc in data_set_loc:
                     # only write to XMP if overwrite check passes
-                    if checkOverwrite(data_set_original[loc], loc, args.field_controls):
+                    if checkOverwrite(data_set_original[loc], loc, overwrite_flags):
                         data_set[loc] = maps_location[loc]
                         xmp.set_property(xmp_fields[loc], loc, maps_location[loc])
                         write_file = True
-                if write_file:
+                if write_file and not from_cache:
                     count['map'] += 1
             else:
                 print("(!) Could not geo loaction data ", end='')
@@ -1309,10 +1847,10 @@ for xmp_file in work_files:  # noqa: C901
                 print("Lightroom data use: {}, Lightroom data ok: {}".format(use_lightroom, lightroom_data_ok))
             # check if the data_set differs from the original (LR db load)
             # if yes write, else skip
-            if use_lightroom and lightroom_data_ok:
+            if use_lightroom and lightroom_data_ok and data_set != data_set_original:
                 for key in data_set:
                     # if not the same (to original data) and passes overwrite check
-                    if data_set[key] != data_set_original[key] and checkOverwrite(data_set_original[key], key, args.field_controls):
+                    if data_set[key] != data_set_original[key] and checkOverwrite(data_set_original[key], key, overwrite_flags):
                         xmp.set_property(xmp_fields[key], key, data_set[key])
                         write_file = True
                 if write_file:
@@ -1320,15 +1858,12 @@ for xmp_file in work_files:  # noqa: C901
         # if we have the write flag set, write data
         if write_file:
             if not args.test:
-                # use copyfile to create a backup copy
+                bk_file = None
                 if not args.no_xmp_backup:
                     # check if there is another file with .BK. already there, if yes, get the max number and +1 it, if not set to 1
                     bk_file_counter = getBackupFileCounter(xmp_file)
-                    # copy to new backup file
-                    copyfile(xmp_file, "{}.BK.{}{}".format(os.path.splitext(xmp_file)[0], bk_file_counter, os.path.splitext(xmp_file)[1]))
-                # write back to riginal file
-                with open(xmp_file, 'w') as fptr:
-                    fptr.write(xmp.serialize_to_str(omit_packet_wrapper=True))
+                    bk_file = "{}.BK.{}{}".format(xmp_file_root, bk_file_counter, xmp_file_ext)
+                writeXmpFile(xmp_file, bk_file)
             else:
                 print("[TEST] Would write {} {}".format(data_set, xmp_file), end='')
             if from_cache:
@@ -1348,6 +1883,9 @@ for xmp_file in work_files:  # noqa: C901
 # close DB connection
 if use_lightroom:
     lrdb.close()
+if cache_db is not None:
+    cache_db.close()
+http_session.close()
 
 # end stats only if we write
 print("{}".format('=' * 40))
@@ -1360,6 +1898,7 @@ if not args.read_only:
     print("New GeoLocation from Map     : {:9,}".format(count['map']))
     print("GeoLocation from Cache       : {:9,}".format(count['cache']))
     print("GeoLocation from Fuzzy Cache : {:9,}".format(count['fuzzy_cache']))
+    print("GeoLocation from Saved Cache : {:9,}".format(count['persistent_cache']))
     print("Failed reverse GeoLocate     : {:9,}".format(count['failed']))
     if use_lightroom:
         print("GeoLocaction from Lightroom  : {:9,}".format(count['lightroom']))